@@ -1,15 +1,18 @@
 import os
-import json
-import requests
-import faiss
+import orjson
 import numpy as np
-import re
-import json
+import random
+import asyncio
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import httpx
 # from fastapi import FastAPI, UploadFile, HTTPException
 from dotenv import load_dotenv
-from PyPDF2 import PdfReader
-import docx
 from fastapi import FastAPI, UploadFile, HTTPException, File
+from fastapi.concurrency import run_in_threadpool
 
 
 # ================= ENV =================
@@ -21,20 +24,79 @@ OR_API_KEY = os.getenv("OPENROUTER_API_KEY")
 if not OR_API_KEY:
     raise RuntimeError("OPENROUTER_API_KEY not found in environment")
 
+# Max number of chunks sent in a single /embeddings request
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Concurrent /embeddings requests when a document needs several batches
+EMBED_MAX_CONCURRENCY = 4
+EMBED_MAX_RETRIES = 3
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Embeddings of recently seen chunks, keyed by SHA-256 of the chunk text (LRU)
+EMBED_CACHE_SIZE = 4096
+_embedding_cache = OrderedDict()
+
+# PDFium is not thread-safe, even across documents; serialise access to it
+_pdfium_lock = threading.Lock()
+
+# Max characters of document context sent to the LLM
+MAX_CONTEXT_CHARS = 2500
+# Max chunks embedded per document; longer documents are sampled evenly.
+# One short of a batch so the retrieval query fits in the same call
+MAX_CHUNKS = EMBED_BATCH_SIZE - 1
+
+# Query used to pick the most relevant chunks of long documents
+RETRIEVAL_QUERY = "Australian Business Number ABN document date compliance"
+
+# ================= HTTP CLIENT =================
+
+# Shared pooled client for all OpenRouter calls. Auth headers are set once
+# here, and idle connections are kept long enough to skip TLS handshakes
+# between uploads.
+_client = httpx.AsyncClient(
+    base_url="https://openrouter.ai/api/v1",
+    headers={
+        "Authorization": f"Bearer {OR_API_KEY}",
+        "Content-Type": "application/json"
+    },
+    http2=True,
+    timeout=60,
+    limits=httpx.Limits(max_connections=32, keepalive_expiry=120)
+)
+
 # ================= FASTAPI =================
 
-app = FastAPI(title="AI Document Validation Agent (OpenRouter)")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await _client.aclose()
+
+app = FastAPI(title="AI Document Validation Agent (OpenRouter)", lifespan=lifespan)
 
 # ================= TEXT EXTRACTION =================
 
 def extract_text(file: UploadFile) -> str:
+    # Extractors read the upload's spooled file in place (memory below 1 MB,
+    # disk above), so rewind it rather than copying the contents out
+    file.file.seek(0)
+
+    # Extractors are imported on first use to keep worker start-up light
     if file.filename.lower().endswith(".pdf"):
-        reader = PdfReader(file.file)
-        return "\n".join([page.extract_text() or "" for page in reader.pages])
+        import pypdfium2 as pdfium
+
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(file.file)
+            try:
+                return "\n".join(
+                    pdf[i].get_textpage().get_text_range()
+                    for i in range(len(pdf))
+                )
+            finally:
+                pdf.close()
 
     if file.filename.lower().endswith(".docx"):
+        import docx
+
         doc = docx.Document(file.file)
-        return "\n".join([p.text for p in doc.paragraphs])
+        return "\n".join(p.text for p in doc.paragraphs)
 
     raise HTTPException(status_code=400, detail="Unsupported file format")
 
@@ -47,114 +109,162 @@ def parse_ai_json(ai_text: str):
     if not ai_text:
         return {"error": "Empty AI response"}
 
+    # analyze_document_with_ai returns an error dict when the call fails
+    if isinstance(ai_text, dict):
+        return ai_text
+
     # Remove ```json ``` or ``` wrappers
-    cleaned = re.sub(r"```json|```", "", ai_text).strip()
+    cleaned = ai_text.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned[3:]
+        if cleaned.startswith("json"):
+            cleaned = cleaned[4:]
+        cleaned = cleaned.rsplit("```", 1)[0]
 
     try:
-        return json.loads(cleaned)
-    except json.JSONDecodeError:
-        return {
-            "error": "Invalid JSON returned by AI",
-            "raw_response": ai_text
-        }
+        return orjson.loads(cleaned)
+    except orjson.JSONDecodeError:
+        pass
+
+    # The model sometimes writes a sentence before the fenced JSON; take
+    # what sits between the first "{" and the last "}"
+    start, end = cleaned.find("{"), cleaned.rfind("}")
+    if start != -1 and end > start:
+        try:
+            return orjson.loads(cleaned[start:end + 1])
+        except orjson.JSONDecodeError:
+            pass
+
+    return {
+        "error": "Invalid JSON returned by AI",
+        "raw_response": ai_text
+    }
 
 # ================= CHUNKING =================
 
-def chunk_text(text, chunk_size=800, overlap=100):
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start = end - overlap
-    return chunks
+def chunk_text(text, chunk_size=2000, overlap=0):
+    if 0 < len(text) <= chunk_size:
+        return [text]
+    starts = range(0, len(text), chunk_size - overlap)
+    return [text[start:start + chunk_size] for start in starts]
 
 # ================= EMBEDDINGS (OPENROUTER) =================
 
-def embed_chunks(chunks):
-    embeddings = []
+def _decode_embedding(value):
+    # base64 payloads are the raw little-endian float32 buffer; fall back to
+    # float lists in case a provider ignores encoding_format
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype="<f4")
+    return np.asarray(value, dtype=np.float32)
 
-    headers = {
-        "Authorization": f"Bearer {OR_API_KEY}",
-        "Content-Type": "application/json"
+async def _post_embedding_batch(batch):
+    payload = {
+        "model": "text-embedding-3-small",
+        "input": batch,
+        "encoding_format": "base64"
     }
 
-    for chunk in chunks:
-        payload = {
-            "model": "text-embedding-3-small",
-            "input": chunk
-        }
-
-        res = requests.post(
-            "https://openrouter.ai/api/v1/embeddings",
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
+    # Spread concurrent submissions a little so they don't hit the rate limit together
+    await asyncio.sleep(random.uniform(0, 0.05))
 
-        if res.status_code != 200:
-            raise RuntimeError("Embedding generation failed")
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        res = await _client.post("/embeddings", json=payload)
 
-        embeddings.append({
-            "text": chunk,
-            "embedding": res.json()["data"][0]["embedding"]
-        })
+        if res.status_code == 200:
+            # The API may return items out of order; "index" maps back to the input
+            return [
+                {"text": batch[d["index"]], "embedding": _decode_embedding(d["embedding"])}
+                for d in sorted(res.json()["data"], key=lambda d: d["index"])
+            ]
 
-    return embeddings
+        if res.status_code not in RETRYABLE_STATUS or attempt == EMBED_MAX_RETRIES:
+            break
 
-# ================= VECTOR STORE =================
+        retry_after = res.headers.get("Retry-After", "")
+        delay = float(retry_after) if retry_after.isdigit() else 0.5 * 2 ** attempt
+        await asyncio.sleep(delay + random.uniform(0, 0.1))
 
-def build_vector_store(embedded_chunks):
-    dim = len(embedded_chunks[0]["embedding"])
-    index = faiss.IndexFlatL2(dim)
+    raise RuntimeError("Embedding generation failed")
 
-    vectors = np.array(
-        [e["embedding"] for e in embedded_chunks],
-        dtype="float32"
-    )
+async def _embed_batches(chunks):
+    batches = [
+        chunks[start:start + EMBED_BATCH_SIZE]
+        for start in range(0, len(chunks), EMBED_BATCH_SIZE)
+    ]
 
-    index.add(vectors)
-    texts = [e["text"] for e in embedded_chunks]
+    if len(batches) == 1:
+        return await _post_embedding_batch(batches[0])
 
-    return index, texts
+    limit = asyncio.Semaphore(EMBED_MAX_CONCURRENCY)
 
-def semantic_search(index, texts, query, top_k=3):
-    headers = {
-        "Authorization": f"Bearer {OR_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    async def post_limited(batch):
+        async with limit:
+            return await _post_embedding_batch(batch)
 
-    payload = {
-        "model": "text-embedding-3-small",
-        "input": query
-    }
+    # gather() returns results in argument order, so batch order is preserved
+    results = await asyncio.gather(*(post_limited(batch) for batch in batches))
+    return [e for batch_result in results for e in batch_result]
+
+async def embed_chunks(chunks):
+    keys = [hashlib.sha256(chunk.encode("utf-8")).hexdigest() for chunk in chunks]
+
+    found = {}
+    for key in keys:
+        if key in _embedding_cache:
+            _embedding_cache.move_to_end(key)
+            found[key] = _embedding_cache[key]
 
-    res = requests.post(
-        "https://openrouter.ai/api/v1/embeddings",
-        headers=headers,
-        json=payload,
-        timeout=30
+    misses = [chunk for chunk, key in zip(chunks, keys) if key not in found]
+    if misses:
+        for e in await _embed_batches(misses):
+            key = hashlib.sha256(e["text"].encode("utf-8")).hexdigest()
+            found[key] = _embedding_cache[key] = e["embedding"]
+            if len(_embedding_cache) > EMBED_CACHE_SIZE:
+                _embedding_cache.popitem(last=False)
+
+    return [
+        {"text": chunk, "embedding": found[key]}
+        for chunk, key in zip(chunks, keys)
+    ]
+
+# ================= VECTOR STORE =================
+
+def build_embedding_matrix(embedded_chunks):
+    # Fill a preallocated C-contiguous buffer row by row instead of
+    # materialising per-row arrays and stacking them
+    vectors = np.empty(
+        (len(embedded_chunks), len(embedded_chunks[0]["embedding"])),
+        dtype=np.float32
     )
+    for i, e in enumerate(embedded_chunks):
+        vectors[i] = e["embedding"]
+    # Unit rows make cosine similarity a single dot product at search time
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    texts = [e["text"] for e in embedded_chunks]
 
-    if res.status_code != 200:
-        raise RuntimeError("Query embedding failed")
+    return vectors, texts
+
+def semantic_search(vectors, texts, query_embedding, top_k=3):
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    query_vector = query_vector / np.linalg.norm(query_vector)
 
-    query_embedding = res.json()["data"][0]["embedding"]
-    query_vector = np.array([query_embedding], dtype="float32")
+    # Cosine similarity against the unit rows; argpartition avoids a full sort
+    scores = vectors @ query_vector
+    top_k = min(top_k, len(texts))
+    nearest = np.argpartition(-scores, top_k - 1)[:top_k]
+    nearest = nearest[np.argsort(-scores[nearest])]
 
-    _, indices = index.search(query_vector, top_k)
-    return [texts[i] for i in indices[0]]
+    return [texts[i] for i in nearest]
 
 # ================= AI ANALYSIS (PROMPT KEPT HERE) =================
 
-def analyze_document_with_ai(context: str):
-    headers = {
-        "Authorization": f"Bearer {OR_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:8000",
-        "X-Title": "doc-validation-agent"
-    }
+# OpenRouter attribution headers, sent on chat calls on top of the client's auth headers
+CHAT_HEADERS = {
+    "HTTP-Referer": "http://localhost:8000",
+    "X-Title": "doc-validation-agent"
+}
 
+async def analyze_document_with_ai(context: str):
     prompt = f"""
 You are an intelligent business document analysis and validation assistant.
 
@@ -203,12 +313,7 @@ Return STRICT JSON:
         "max_tokens": 300
     }
 
-    res = requests.post(
-        "https://openrouter.ai/api/v1/chat/completions",
-        headers=headers,
-        json=payload,
-        timeout=60
-    )
+    res = await _client.post("/chat/completions", headers=CHAT_HEADERS, json=payload)
 
     if res.status_code != 200:
         return {"error": "AI analysis unavailable",
@@ -224,27 +329,39 @@ Return STRICT JSON:
 
 @app.post("/validate-document")
 async def validate_document(file: UploadFile = File(...)):
-    text = extract_text(file)
+    # Parsing is CPU-bound; keep it off the event loop
+    text = await run_in_threadpool(extract_text, file)
 
     if not text.strip():
         raise HTTPException(status_code=400, detail="No text extracted from document")
 
-    chunks = chunk_text(text)
-    embedded_chunks = embed_chunks(chunks)
-
-    index, texts = build_vector_store(embedded_chunks)
+    if len(text) <= MAX_CONTEXT_CHARS:
+        # The whole document fits in the prompt; retrieval would only drop text
+        context = text
+    else:
+        # Repeated boilerplate (per-page headers/footers) yields identical
+        # chunks; embed each distinct chunk once, keeping first-seen order
+        chunks = list(dict.fromkeys(chunk_text(text)))
+        # Only the top 3 chunks survive; sample very long documents evenly
+        # instead of paying to embed every chunk
+        if len(chunks) > MAX_CHUNKS:
+            step = len(chunks) / MAX_CHUNKS
+            chunks = [chunks[int(i * step)] for i in range(MAX_CHUNKS)]
+        # The query rides along in the same embeddings call as the chunks
+        embedded = await embed_chunks([RETRIEVAL_QUERY] + chunks)
+
+        vectors, texts = build_embedding_matrix(embedded[1:])
+
+        relevant_chunks = semantic_search(
+            vectors,
+            texts,
+            embedded[0]["embedding"],
+            top_k=3
+        )
+        context = "\n".join(relevant_chunks)
+        context = context[:MAX_CONTEXT_CHARS]
 
-    relevant_chunks = semantic_search(
-        index,
-        texts,
-        query="Australian Business Number ABN document date compliance",
-        top_k=3
-    )
-    MAX_CONTEXT_CHARS = 2500
-    context = "\n".join(relevant_chunks)
-    context = context[:MAX_CONTEXT_CHARS]
-    
-    ai_raw = analyze_document_with_ai(context)
+    ai_raw = await analyze_document_with_ai(context)
     ai_parsed = parse_ai_json(ai_raw)
 
     missing = ai_parsed.get("missing_fields", [])
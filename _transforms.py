@@ -0,0 +1,43 @@
+# --------------------------------------------------
+# Graph payload -> frontend shape transforms
+# --------------------------------------------------
+# Kept free of Quart/httpx so the module can be compiled on its own:
+#
+#     mypyc _transforms.py
+#
+# The compiled extension is picked up by `import _transforms` in place of
+# this file; without it the plain Python version runs unchanged.
+from typing import Any, Dict, List
+
+
+def site_summary(site: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "site_id": site["id"],
+        "displayName": site["displayName"],
+        "webUrl": site["webUrl"]
+    }
+
+
+def list_summaries(values: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [{
+        "list_id": lst["id"],
+        "displayName": lst.get("displayName"),
+        "template": lst.get("list", {}).get("template")
+    } for lst in values]
+
+
+def document_libraries(values: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [d for d in values if d.get("driveType") == "documentLibrary"]
+
+
+def user_entries(values: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    users: List[Dict[str, Any]] = []
+    for u in values:
+        email = u.get("mail") or u.get("userPrincipalName")
+        if email:
+            users.append({
+                "displayName": u["displayName"],
+                "email": email,
+                "claims": "i:0#.f|membership|" + email
+            })
+    return users
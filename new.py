@@ -1389,92 +1389,454 @@
 
 
 
-import requests
-from flask import Flask, jsonify, request
-from flask_cors import CORS  # <--- NEW IMPORT
-
-app = Flask(__name__)
-CORS(app)  # <--- THIS ENABLES THE CONNECTION
+import asyncio
+import base64
+import hashlib
+import re
+import time
+from functools import lru_cache
+from types import MappingProxyType
+from urllib.parse import quote
+import httpx
+import orjson
+from cachetools import TTLCache
+from quart import Quart, Response, g, request
+from quart_cors import cors
+
+from _transforms import document_libraries, list_summaries, site_summary, user_entries
+
+app = Quart(__name__)
+app = cors(app)  # <--- THIS ENABLES THE CONNECTION
+# Quart caps request bodies at 16 MB by default; Flask didn't
+app.config["MAX_CONTENT_LENGTH"] = None
 
 GRAPH_BASE = "https://graph.microsoft.com/v1.0"
 
 HOSTNAME = "aoscaustralia.sharepoint.com"
 SITE_PATH = "/sites/CPA"
 
+# Graph URL templates, built once. Paths are relative to GRAPH_BASE so the
+# same template serves direct calls and $batch entries. $select limits each
+# response to the properties the routes actually return.
+SITE_URL = f"{GRAPH_BASE}/sites/{HOSTNAME}:{SITE_PATH}?$select=id,displayName,webUrl"
+SITE_WITH_LISTS_URL = SITE_URL + "&$expand=lists($select=id,displayName,list)"
+LISTS_PATH = "/sites/{site_id}/lists?$select=id,displayName,list"
+DRIVES_PATH = "/sites/{site_id}/drives?$select=id,name,webUrl,driveType"
+LISTS_URL = GRAPH_BASE + LISTS_PATH
+DRIVES_URL = GRAPH_BASE + DRIVES_PATH
+LIST_ITEMS_PATH = "/sites/{site_id}/lists/{list_id}/items"
+LIST_ITEMS_URL = GRAPH_BASE + LIST_ITEMS_PATH
+# List columns are user-defined, so fields are returned whole
+LIST_ITEMS_FIELDS_URL = LIST_ITEMS_URL + "?$select=id&$expand=fields&$top=999"
+# {email} must already be escaped with odata_string(); only the item id is needed
+PROFILE_SEARCH_URL = (
+    LIST_ITEMS_URL + "?$select=id&$expand=fields($select=EmailAddress)"
+    "&$filter=fields/EmailAddress eq '{email}'"
+)
+ITEM_FIELDS_URL = GRAPH_BASE + "/sites/{site_id}/lists/{list_id}/items/{item_id}/fields"
+DRIVE_CHILDREN_URL = (
+    GRAPH_BASE + "/drives/{drive_id}/root/children"
+    "?$select=id,name,webUrl,size,file,folder,lastModifiedDateTime&$top=999"
+)
+DRIVE_CONTENT_URL = GRAPH_BASE + "/drives/{drive_id}/root:/{filename}:/content"
+UPLOAD_SESSION_URL = GRAPH_BASE + "/drives/{drive_id}/root:/{filename}:/createUploadSession"
+USERS_PATH = "/users?$select=displayName,mail,userPrincipalName&$top=999"
+USERS_URL = GRAPH_BASE + USERS_PATH
+BATCH_URL = f"{GRAPH_BASE}/$batch"
+# Graph rejects $batch envelopes with more than 20 requests
+GRAPH_BATCH_LIMIT = 20
+BATCH_MAX_CONCURRENCY = 4
+
+# Read-only SharePoint columns, and the etag annotation clients echo back
+# from reads, that Graph refuses on create/update
+SYSTEM_FIELDS = frozenset({
+    "PercentComplete", "LastUpdated", "Created", "Modified", "ID", "Author", "Editor", "@odata.etag"
+})
+
+# Deliberately loose: one "@", no whitespace. Graph does the real matching
+EMAIL_PATTERN = re.compile(r"[^@\s]+@[^@\s]+")
+
+GRAPH_MAX_RETRIES = 3
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Files above this size go through a resumable upload session; slices
+# must be a multiple of 320 KiB
+SIMPLE_UPLOAD_LIMIT = 4 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 10 * 1024 * 1024
+
+# Site, lists, libraries and users change rarely; serve repeat reads from
+# memory for a few minutes. Keyed per caller so permissions are respected.
+GRAPH_CACHE_TTL = 300
+graph_cache = TTLCache(maxsize=4096, ttl=GRAPH_CACHE_TTL)
+# The configured site practically never changes, so it is resolved once a
+# day and shared by all callers. Only used where a follow-up call made with
+# the caller's own token proves their access to it.
+site_cache = TTLCache(maxsize=8, ttl=24 * 60 * 60)
+
+# Last response per cache key for Graph GETs that carried an ETag. Once
+# graph_cache expires, the refetch is conditional and a 304 reuses the
+# stored body instead of downloading it again.
+graph_validators = TTLCache(maxsize=256, ttl=60 * 60)
+
+# Graph calls currently in flight, by cache key
+graph_inflight = {}
+
+# Each caller's copy of the user directory for the People Picker, searched
+# locally on every keystroke. Stale copies are still served while a
+# background refresh runs; tokens are delegated, so there is no app-level
+# credential to refresh them on a schedule.
+USERS_STALE_AFTER = 15 * 60
+user_directories = TTLCache(maxsize=256, ttl=60 * 60)
+
+# Profile item id by (site, list, email) once found or created, so repeat
+# saves PATCH straight away instead of searching first. Graph still checks
+# the caller's access on the PATCH itself.
+profile_item_ids = TTLCache(maxsize=4096, ttl=60 * 60)
+
+# Profile save running per (token, site, list, email), and the one queued
+# behind it with its fields. Saves arriving while one is queued merge into
+# it, so a burst of auto-saves costs at most two round trips.
+profile_saves = {}
+queued_profile_saves = {}
+
+# --------------------------------------------------
+# Shared async HTTP client for all Graph calls
+# --------------------------------------------------
+# HTTP/2 multiplexes concurrent Graph calls over warm TLS connections;
+# the transport also retries failed connection attempts. httpx drops idle
+# connections after 5s by default, shorter than the gap between a user's
+# clicks, so keep them for two minutes.
+client = httpx.AsyncClient(
+    timeout=30.0,
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=GRAPH_MAX_RETRIES,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=100, keepalive_expiry=120)
+    )
+)
+
+@app.after_serving
+async def close_client():
+    await client.aclose()
+
+# --------------------------------------------------
+# Helper: Read a token's expiry without calling Graph
+# --------------------------------------------------
+# The signature is still checked by Graph; this only lets expired tokens be
+# refused without a round-trip. Tokens that aren't JWTs return None and are
+# left for Graph to judge.
+@lru_cache(maxsize=4096)
+def token_expiry(token):
+    try:
+        payload = token.split(".")[1]
+        claims = orjson.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
 # --------------------------------------------------
 # Helper: Get Delegated User Token
 # --------------------------------------------------
-def get_headers():
+# Checked once per request; later calls reuse the answer from g
+def bearer_auth():
+    if "bearer_auth" not in g:
+        g.bearer_auth = read_bearer_auth()
+    return g.bearer_auth
+
+def read_bearer_auth():
     auth = request.headers.get("Authorization")
     if not auth or not auth.startswith("Bearer "):
         return None
 
-    return {
+    expiry = token_expiry(auth[7:])
+    if expiry is not None and expiry < time.time():
+        return None
+
+    return auth
+
+# GETs carry no body, so they send the token alone
+def get_auth_headers():
+    auth = bearer_auth()
+    return auth and auth_headers_for(auth)
+
+def get_json_headers():
+    auth = bearer_auth()
+    return auth and json_headers_for(auth)
+
+# One shared, read-only header mapping per token instead of a new dict on
+# every request; copy it before adding headers
+@lru_cache(maxsize=1024)
+def auth_headers_for(auth):
+    return MappingProxyType({"Authorization": auth})
+
+@lru_cache(maxsize=1024)
+def json_headers_for(auth):
+    return MappingProxyType({
         "Authorization": auth,
         "Content-Type": "application/json"
-    }
+    })
+
+# --------------------------------------------------
+# Require a bearer token before any route runs
+# --------------------------------------------------
+# CORS preflights, /health and unknown paths are let through; every other
+# handler can rely on get_auth_headers()/get_json_headers() returning headers.
+@app.before_request
+async def require_bearer_auth():
+    if request.method == "OPTIONS" or request.url_rule is None or request.endpoint == "health":
+        return None
+
+    if bearer_auth() is None:
+        return ojson({"error": "Missing or expired Authorization header"}, 401)
+
+# --------------------------------------------------
+# Helper: GET every page of a collection
+# --------------------------------------------------
+# Graph's skiptokens are opaque, so pages can't be requested ahead of time;
+# the next link has to come from the previous page
+async def graph_get_all(url, headers):
+    res, values = None, []
+    while url:
+        res = await graph_get(url, headers)
+        if not res.is_success:
+            break
+
+        page = orjson.loads(res.content)
+        values.extend(page.get("value", []))
+        url = page.get("@odata.nextLink")
+
+    return res, values
+
+# --------------------------------------------------
+# Helper: Stream every page of a collection as one JSON array
+# --------------------------------------------------
+# Graph's collection envelope normally ends with the "value" array, so
+# pass-through routes can forward the array's bytes without decoding them.
+# Pages in any other shape fall back to a real parse.
+VALUE_ENVELOPE = re.compile(rb'\{"@odata\.context":"[^"]*"(?:,"@odata\.nextLink":("[^"]*"))?,"value":\[')
+
+def split_page(raw):
+    match = VALUE_ENVELOPE.match(raw)
+    if match and raw.endswith(b"]}"):
+        return raw[match.end():-2], orjson.loads(match.group(1)) if match.group(1) else None
+
+    page = orjson.loads(raw)
+    return orjson.dumps(page.get("value", []))[1:-1], page.get("@odata.nextLink")
+
+# The first page is fetched up front so a Graph error still becomes an
+# error response; later pages go out as they arrive, holding one page in
+# memory at a time. A later failure aborts the response instead of ending
+# the array early.
+async def graph_stream_raw(url, headers):
+    res = await graph_get(url, headers)
+    if not res.is_success:
+        return res, None
+
+    async def body(res):
+        yield b"["
+        separator = b""
+        while True:
+            part, url = split_page(res.content)
+            if part:
+                yield separator + part
+                separator = b","
+            if not url:
+                break
+
+            res = await graph_get(url, headers)
+            res.raise_for_status()
+        yield b"]"
+
+    return res, body(res)
+
+# --------------------------------------------------
+# Helper: JSON response via orjson
+# --------------------------------------------------
+def ojson(obj, status=200):
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+# --------------------------------------------------
+# Helper: Pass a failed Graph response back to the caller
+# --------------------------------------------------
+# Only reached on failure, so the body is decoded for error responses alone
+def graph_error(res):
+    return ojson({"error": "Graph API error", "details": res.text}, res.status_code)
+
+# --------------------------------------------------
+# Helper: JSON request body via orjson
+# --------------------------------------------------
+# None for a missing, non-JSON or malformed body, like a failed get_json()
+async def request_json():
+    if not request.is_json:
+        return None
+    try:
+        return orjson.loads(await request.get_data())
+    except orjson.JSONDecodeError:
+        return None
+
+# --------------------------------------------------
+# Helper: GET with retry on throttling / transient errors
+# --------------------------------------------------
+async def graph_get(url, headers):
+    key = cache_key(headers, url)
+    validated = graph_validators.get(key)
+    if validated is not None:
+        headers = {**headers, "If-None-Match": validated.headers["ETag"]}
+
+    for attempt in range(GRAPH_MAX_RETRIES + 1):
+        res = await client.get(url, headers=headers)
+        if res.status_code == 304 and validated is not None:
+            return validated
+
+        if res.status_code not in RETRYABLE_STATUS or attempt == GRAPH_MAX_RETRIES:
+            if res.is_success and "ETag" in res.headers:
+                graph_validators[key] = res
+            elif res.is_success:
+                graph_validators.pop(key, None)
+            return res
+
+        retry_after = res.headers.get("Retry-After", "")
+        await asyncio.sleep(float(retry_after) if retry_after.isdigit() else 0.2 * 2 ** attempt)
+
+# --------------------------------------------------
+# Helper: Cache key for a caller's GET
+# --------------------------------------------------
+def cache_key(headers, url):
+    # Bearer tokens run to a couple of KB; a 16-byte digest keeps keys small
+    token = hashlib.blake2b(headers["Authorization"].encode(), digest_size=16).digest()
+    return (token, url)
+
+# --------------------------------------------------
+# Helper: Resolve the configured site, shared across callers
+# --------------------------------------------------
+async def resolve_site(headers):
+    site = site_cache.get((HOSTNAME, SITE_PATH))
+    if site is not None:
+        return None, site
+
+    res = await graph_get(SITE_URL, headers)
+    if not res.is_success:
+        return res, None
+
+    site = site_cache[(HOSTNAME, SITE_PATH)] = orjson.loads(res.content)
+    return res, site
+
+# --------------------------------------------------
+# Helper: Quote a value for an OData string literal in a URL
+# --------------------------------------------------
+def odata_string(value):
+    # Quotes are doubled per OData; the rest is percent-encoded so "+", "#"
+    # and "&" reach Graph intact
+    return quote(value.replace("'", "''"), safe="@.")
+
+# --------------------------------------------------
+# Helper: Share one in-flight Graph call between identical requests
+# --------------------------------------------------
+# The cache covers repeats over time; this covers the burst of identical
+# calls the SPA makes on mount, before the first one has filled the cache
+def inflight_task(key, fetch):
+    task = graph_inflight.get(key)
+    if task is None:
+        task = graph_inflight[key] = asyncio.ensure_future(fetch())
+        task.add_done_callback(lambda _: graph_inflight.pop(key, None))
+    return task
+
+async def coalesced(key, fetch):
+    # Shielded so one caller disconnecting doesn't cancel the others' call
+    return await asyncio.shield(inflight_task(key, fetch))
+
+# --------------------------------------------------
+# Helper: Stream an uploaded file without loading it into memory
+# --------------------------------------------------
+async def read_chunks(stream, chunk_size=1024 * 1024):
+    while chunk := stream.read(chunk_size):
+        yield chunk
+
+# --------------------------------------------------
+# Helper: NDJSON response, one record per line
+# --------------------------------------------------
+def wants_ndjson():
+    return "application/x-ndjson" in request.headers.get("Accept", "")
+
+CLAIMS_PREFIX = b'"i:0#.f|membership|'
+
+# Builds each user line from byte pieces; the email is JSON-escaped once
+# and reused for both the email and claims values
+def user_lines(users):
+    # Runs once per directory entry; skip the module attribute lookup
+    dumps = orjson.dumps
+    for u in users:
+        email = dumps(u["email"])[1:-1]
+        yield (
+            b'{"displayName":' + dumps(u["displayName"])
+            + b',"email":"' + email
+            + b'","claims":' + CLAIMS_PREFIX + email + b'"}\n'
+        )
 
 # --------------------------------------------------
 # STEP 1: Resolve SharePoint Site
 # --------------------------------------------------
 @app.route("/sharepoint/site", methods=["GET"])
-def get_site():
-    headers = get_headers()
-    if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
-
-    url = f"{GRAPH_BASE}/sites/{HOSTNAME}:{SITE_PATH}"
-    res = requests.get(url, headers=headers)
-
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
-
-    site = res.json()
-    return jsonify({
-        "site_id": site["id"],
-        "displayName": site["displayName"],
-        "webUrl": site["webUrl"]
-    })
+async def get_site():
+    headers = get_auth_headers()
+
+    # The site's lists come back in the same call, so clients can skip
+    # /lists right after
+    url = SITE_WITH_LISTS_URL
+    key = cache_key(headers, url)
+    if key in graph_cache:
+        return ojson(graph_cache[key])
+
+    res = await coalesced(key, lambda: graph_get(url, headers))
+
+    if not res.is_success:
+        return graph_error(res)
+
+    site = orjson.loads(res.content)
+    lists = site.pop("lists", [])
+    more_res, more = await graph_get_all(site.pop("lists@odata.nextLink", None), headers)
+    if more_res is not None and not more_res.is_success:
+        return graph_error(more_res)
+
+    site_cache[(HOSTNAME, SITE_PATH)] = site
+    lists = graph_cache[cache_key(headers, LISTS_URL.format(site_id=site["id"]))] = list_summaries(lists + more)
+    graph_cache[key] = {**site_summary(site), "lists": lists}
+    return ojson(graph_cache[key])
 
 # --------------------------------------------------
 # STEP 2: Get Lists
 # --------------------------------------------------
 @app.route("/sharepoint/<site_id>/lists", methods=["GET"])
-def get_lists(site_id):
-    headers = get_headers()
-    if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+async def get_lists(site_id):
+    headers = get_auth_headers()
 
-    url = f"{GRAPH_BASE}/sites/{site_id}/lists"
-    res = requests.get(url, headers=headers)
+    url = LISTS_URL.format(site_id=site_id)
+    key = cache_key(headers, url)
+    if key in graph_cache:
+        return ojson(graph_cache[key])
 
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
+    res, values = await coalesced(key, lambda: graph_get_all(url, headers))
 
-    lists = [{
-        "list_id": lst["id"],
-        "displayName": lst.get("displayName"),
-        "template": lst.get("list", {}).get("template")
-    } for lst in res.json().get("value", [])]
+    if not res.is_success:
+        return graph_error(res)
 
-    return jsonify(lists)
+    graph_cache[key] = list_summaries(values)
+    return ojson(graph_cache[key])
 
 # --------------------------------------------------
 # STEP 3: Get List Items
 # --------------------------------------------------
 @app.route("/sharepoint/<site_id>/lists/<list_id>/items", methods=["GET"])
-def get_list_items(site_id, list_id):
-    headers = get_headers()
-    if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+async def get_list_items(site_id, list_id):
+    headers = get_auth_headers()
 
-    url = f"{GRAPH_BASE}/sites/{site_id}/lists/{list_id}/items?expand=fields"
-    res = requests.get(url, headers=headers)
+    url = LIST_ITEMS_FIELDS_URL.format(site_id=site_id, list_id=list_id)
+    res, body = await graph_stream_raw(url, headers)
 
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
+    if not res.is_success:
+        return graph_error(res)
 
-    return jsonify(res.json().get("value", []))
+    return Response(body, mimetype="application/json")
 
 # --------------------------------------------------
 # STEP 4: Create List Item (POST) – FULLY FIXED
@@ -1536,63 +1898,152 @@ def get_list_items(site_id, list_id):
 
 
 # --------------------------------------------------
-# STEP 4: UPSERT ITEM (With "Prefer" Header Fix)
+# Helper: Search-then-update/create one profile item
 # --------------------------------------------------
-@app.route("/sharepoint/<site_id>/lists/<list_id>/items", methods=["POST"])
-def upsert_list_item(site_id, list_id):
-    headers = get_headers()
-    if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+async def save_profile(site_id, list_id, fields, headers):
+    profile_key = (site_id, list_id, fields["EmailAddress"].lower())
+    item_id = profile_item_ids.get(profile_key)
 
-    body = request.get_json()
-    if not body or "fields" not in body:
-        return jsonify({"error": "fields object required"}), 400
+    if item_id is not None:
+        update_url = ITEM_FIELDS_URL.format(site_id=site_id, list_id=list_id, item_id=item_id)
+        update_res = await client.patch(update_url, headers=headers, json=fields)
+        if update_res.is_success:
+            return {"status": "Updated", "id": item_id, "fields": fields}, 200
 
-    fields = body["fields"]
-    email = fields.get("EmailAddress")
-    
-    if not email:
-        return jsonify({"error": "EmailAddress is required to check for existing profile"}), 400
+        # A deleted item falls through to a fresh search; anything else failed
+        profile_item_ids.pop(profile_key, None)
+        if update_res.status_code != 404:
+            return {"error": "Failed to update item", "details": update_res.text}, 500
 
     # ✅ THE FIX: Add this special header to allow searching by Email
     search_headers = headers.copy()
     search_headers["Prefer"] = "HonorNonIndexedQueriesWarningMayFailRandomly"
 
     # Search for existing user by Email
-    search_url = f"{GRAPH_BASE}/sites/{site_id}/lists/{list_id}/items?expand=fields&$filter=fields/EmailAddress eq '{email}'"
+    search_url = PROFILE_SEARCH_URL.format(site_id=site_id, list_id=list_id, email=odata_string(fields["EmailAddress"]))
     
     # Note: We use 'search_headers' here instead of just 'headers'
-    search_res = requests.get(search_url, headers=search_headers)
+    search_res = await graph_get(search_url, search_headers)
     
-    if not search_res.ok:
-        return jsonify({"error": "Failed to search list", "details": search_res.text}), 500
+    if not search_res.is_success:
+        return {"error": "Failed to search list", "details": search_res.text}, 500
 
-    search_data = search_res.json()
+    search_data = orjson.loads(search_res.content)
     existing_items = search_data.get("value", [])
 
-    # Cleanup system fields
-    for f in ["PercentComplete", "LastUpdated", "Created", "Modified", "ID", "Author", "Editor"]:
-        fields.pop(f, None)
-
     if len(existing_items) > 0:
         # --- UPDATE (PATCH) ---
-        item_id = existing_items[0]["id"]
+        item_id = profile_item_ids[profile_key] = existing_items[0]["id"]
         print(f"🔄 Found existing profile (ID: {item_id}). Updating...")
-        update_url = f"{GRAPH_BASE}/sites/{site_id}/lists/{list_id}/items/{item_id}/fields"
-        update_res = requests.patch(update_url, headers=headers, json=fields)
-        if not update_res.ok:
-            return jsonify({"error": "Failed to update item", "details": update_res.text}), 500
-        return jsonify({"status": "Updated", "id": item_id, "fields": fields}), 200
+        update_url = ITEM_FIELDS_URL.format(site_id=site_id, list_id=list_id, item_id=item_id)
+        update_res = await client.patch(update_url, headers=headers, json=fields)
+        if not update_res.is_success:
+            return {"error": "Failed to update item", "details": update_res.text}, 500
+        return {"status": "Updated", "id": item_id, "fields": fields}, 200
 
     else:
         # --- CREATE (POST) ---
         print("🆕 No profile found. Creating new...")
-        create_url = f"{GRAPH_BASE}/sites/{site_id}/lists/{list_id}/items"
-        create_res = requests.post(create_url, headers=headers, json={"fields": fields})
-        if not create_res.ok:
-            return jsonify({"error": "Failed to create item", "details": create_res.text}), 500
-        return jsonify(create_res.json()), 201
+        create_url = LIST_ITEMS_URL.format(site_id=site_id, list_id=list_id)
+        create_res = await client.post(create_url, headers=headers, json={"fields": fields})
+        if not create_res.is_success:
+            return {"error": "Failed to create item", "details": create_res.text}, 500
+        created = orjson.loads(create_res.content)
+        profile_item_ids[profile_key] = created["id"]
+        return created, 201
+
+# --------------------------------------------------
+# Helper: Run profile saves one at a time per key, merging bursts
+# --------------------------------------------------
+def queue_profile_save(key, fields, save):
+    queued = queued_profile_saves.get(key)
+    if queued is not None:
+        queued[0].update(fields)
+        return queued[1]
+
+    running = profile_saves.get(key)
+    merged = dict(fields)
+
+    async def run():
+        if running is not None:
+            await asyncio.wait([running])
+            # Later saves now queue behind this one instead of merging in
+            queued_profile_saves.pop(key, None)
+        return await save(merged)
+
+    task = profile_saves[key] = asyncio.ensure_future(run())
+    task.add_done_callback(lambda _: profile_saves.pop(key) if profile_saves.get(key) is task else None)
+    if running is not None:
+        queued_profile_saves[key] = (merged, task)
+    return task
+
+# --------------------------------------------------
+# STEP 4: UPSERT ITEM (With "Prefer" Header Fix)
+# --------------------------------------------------
+@app.route("/sharepoint/<site_id>/lists/<list_id>/items", methods=["POST"])
+async def upsert_list_item(site_id, list_id):
+    headers = get_json_headers()
+
+    body = await request_json()
+    if not body or "fields" not in body:
+        return ojson({"error": "fields object required"}, 400)
+
+    # Cleanup system fields (copied, so the request body isn't mutated)
+    fields = {k: v for k, v in body["fields"].items() if k not in SYSTEM_FIELDS}
+    email = fields.get("EmailAddress")
     
+    if not email:
+        return ojson({"error": "EmailAddress is required to check for existing profile"}, 400)
+    if not isinstance(email, str) or not EMAIL_PATTERN.fullmatch(email):
+        return ojson({"error": "EmailAddress is not a valid email address"}, 400)
+
+    task = queue_profile_save(cache_key(headers, (site_id, list_id, email.lower())), fields,
+                              lambda merged: save_profile(site_id, list_id, merged, headers))
+    # Shielded so one caller disconnecting doesn't cancel the shared save
+    result, status = await asyncio.shield(task)
+    return ojson(result, status)
+
+# --------------------------------------------------
+# STEP 4b: Bulk Create Items (Graph $batch)
+# --------------------------------------------------
+@app.route("/sharepoint/<site_id>/lists/<list_id>/items:batch", methods=["POST"])
+async def batch_create_list_items(site_id, list_id):
+    headers = get_json_headers()
+
+    rows = await request_json()
+    if not rows or not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        return ojson({"error": "Array of fields objects required"}, 400)
+
+    path = LIST_ITEMS_PATH.format(site_id=site_id, list_id=list_id)
+    limit = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def send(start):
+        batch = {"requests": [{
+            "id": str(i),
+            "method": "POST",
+            "url": path,
+            "headers": {"Content-Type": "application/json"},
+            "body": {"fields": {k: v for k, v in rows[i].items() if k not in SYSTEM_FIELDS}}
+        } for i in range(start, min(start + GRAPH_BATCH_LIMIT, len(rows)))]}
+
+        async with limit:
+            res = await client.post(BATCH_URL, headers=headers, json=batch)
+
+        if not res.is_success:
+            return [{"index": int(r["id"]), "status": res.status_code, "error": res.text} for r in batch["requests"]]
+
+        results = []
+        for r in orjson.loads(res.content).get("responses", []):
+            if r["status"] < 400:
+                results.append({"index": int(r["id"]), "status": r["status"], "id": r["body"]["id"]})
+            else:
+                results.append({"index": int(r["id"]), "status": r["status"], "error": r.get("body")})
+        return results
+
+    chunks = await asyncio.gather(*(send(start) for start in range(0, len(rows), GRAPH_BATCH_LIMIT)))
+
+    # Batch responses can come back in any order
+    return ojson(sorted((r for chunk in chunks for r in chunk), key=lambda r: r["index"]))
 
 
 
@@ -1601,108 +2052,236 @@ def upsert_list_item(site_id, list_id):
 # STEP 5: Get Document Libraries
 # --------------------------------------------------
 @app.route("/sharepoint/<site_id>/libraries", methods=["GET"])
-def get_libraries(site_id):
-    headers = get_headers()
-    if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+async def get_libraries(site_id):
+    headers = get_auth_headers()
 
-    url = f"{GRAPH_BASE}/sites/{site_id}/drives"
-    res = requests.get(url, headers=headers)
+    url = DRIVES_URL.format(site_id=site_id)
+    key = cache_key(headers, url)
+    if key in graph_cache:
+        return ojson(graph_cache[key])
 
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
+    res, values = await coalesced(key, lambda: graph_get_all(url, headers))
 
-    libraries = [
-        d for d in res.json().get("value", [])
-        if d.get("driveType") == "documentLibrary"
-    ]
+    if not res.is_success:
+        return graph_error(res)
 
-    return jsonify(libraries)
+    graph_cache[key] = document_libraries(values)
+    return ojson(graph_cache[key])
 
 # --------------------------------------------------
 # STEP 6: Get Documents
 # --------------------------------------------------
 @app.route("/sharepoint/<site_id>/libraries/<drive_id>/documents", methods=["GET"])
-def get_documents(site_id, drive_id):
-    headers = get_headers()
-    if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+async def get_documents(site_id, drive_id):
+    headers = get_auth_headers()
+
+    url = DRIVE_CHILDREN_URL.format(drive_id=drive_id)
+    res, body = await graph_stream_raw(url, headers)
 
-    url = f"{GRAPH_BASE}/drives/{drive_id}/root/children"
-    res = requests.get(url, headers=headers)
+    if not res.is_success:
+        return graph_error(res)
+
+    return Response(body, mimetype="application/json")
+
+# --------------------------------------------------
+# Helper: Send a file to a drive, by simple PUT or upload session
+# --------------------------------------------------
+async def upload_file(drive_id, headers, filename, content_type, stream, size):
+    if size <= SIMPLE_UPLOAD_LIMIT:
+        upload_url = DRIVE_CONTENT_URL.format(drive_id=drive_id, filename=filename)
+
+        upload_headers = {
+            "Authorization": headers["Authorization"],
+            "Content-Type": content_type or "application/octet-stream",
+            "Content-Length": str(size)
+        }
+
+        return await client.put(upload_url, headers=upload_headers, content=read_chunks(stream))
+
+    session_url = UPLOAD_SESSION_URL.format(drive_id=drive_id, filename=filename)
+    res = await client.post(session_url, headers=headers, json={})
+
+    if res.is_success:
+        # The upload URL is pre-authenticated; sending the bearer token
+        # to it makes Graph reject the request
+        upload_url = orjson.loads(res.content)["uploadUrl"]
+        offset = 0
+        while chunk := stream.read(UPLOAD_CHUNK_SIZE):
+            end = offset + len(chunk) - 1
+            res = await client.put(
+                upload_url,
+                headers={"Content-Range": f"bytes {offset}-{end}/{size}"},
+                content=chunk
+            )
+            if not res.is_success:
+                break
+            offset = end + 1
+
+    return res
+
+# --------------------------------------------------
+# Helper: Upload from the spooled multipart file
+# --------------------------------------------------
+# Quart spools the file part (memory while small, disk past that), so its
+# size is known before picking a single PUT or upload-session slices
+async def upload_multipart(drive_id, headers):
+    files = await request.files
+    if "file" not in files:
+        return None
 
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
+    file = files["file"]
+    stream = file.stream
+    size = stream.seek(0, 2)
+    stream.seek(0)
 
-    return jsonify(res.json().get("value", []))
+    return await upload_file(drive_id, headers, file.filename, file.content_type, stream, size)
 
 # --------------------------------------------------
 # STEP 7: Upload Document
 # --------------------------------------------------
 @app.route("/sharepoint/<site_id>/libraries/<drive_id>/upload", methods=["POST"])
-def upload_document(site_id, drive_id):
-    headers = get_headers()
-    if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+async def upload_document(site_id, drive_id):
+    headers = get_json_headers()
+    res = await upload_multipart(drive_id, headers)
 
-    if "file" not in request.files:
-        return jsonify({"error": "No file provided"}), 400
+    if res is None:
+        return ojson({"error": "No file provided"}, 400)
 
-    file = request.files["file"]
+    if not res.is_success:
+        return graph_error(res)
 
-    upload_url = f"{GRAPH_BASE}/drives/{drive_id}/root:/{file.filename}:/content"
+    return Response(res.content, mimetype="application/json")
 
-    upload_headers = {
-        "Authorization": headers["Authorization"],
-        "Content-Type": file.content_type or "application/octet-stream"
-    }
-
-    res = requests.put(upload_url, headers=upload_headers, data=file.read())
+# --------------------------------------------------
+# Helper: Fetch and index a caller's user directory
+# --------------------------------------------------
+def store_user_directory(key, values):
+    users = user_entries(values)
+    search_keys = [f"{u['displayName'] or ''}\n{u['email']}".lower() for u in users]
+    directory = user_directories[key] = (time.monotonic(), users, search_keys)
+    return directory
 
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
+async def load_user_directory(key, headers):
+    res, values = await graph_get_all(USERS_URL, headers)
+    if not res.is_success:
+        return res, None
 
-    return jsonify(res.json())
+    return res, store_user_directory(key, values)
 
 # --------------------------------------------------
 # STEP 8: Get Users (People Picker)
 # --------------------------------------------------
 @app.route("/graph/users", methods=["GET"])
-def graph_get_users():
-    headers = get_headers()
-    if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+async def graph_get_users():
+    headers = get_auth_headers()
 
-    url = f"{GRAPH_BASE}/users?$select=displayName,mail,userPrincipalName"
-    res = requests.get(url, headers=headers)
+    key = cache_key(headers, USERS_URL)
+    directory = user_directories.get(key)
 
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
+    if directory is None:
+        res, directory = await coalesced(key, lambda: load_user_directory(key, headers))
 
-    users = []
-    for u in res.json().get("value", []):
-        email = u.get("mail") or u.get("userPrincipalName")
-        if not email:
-            continue
+        if not res.is_success:
+            return graph_error(res)
 
-        users.append({
-            "displayName": u["displayName"],
-            "email": email,
-            "claims": f"i:0#.f|membership|{email}"
-        })
+    elif time.monotonic() - directory[0] > USERS_STALE_AFTER:
+        inflight_task(key, lambda: load_user_directory(key, headers))
 
-    return jsonify(users)
+    _, users, search_keys = directory
+
+    # ?q= filters by display name or email, case-insensitively
+    q = request.args.get("q", "").strip().lower()
+    if q:
+        users = [u for u, k in zip(users, search_keys) if q in k]
+
+    # Large directories can be streamed line by line for clients that ask
+    if wants_ndjson():
+        return Response(user_lines(users), mimetype="application/x-ndjson")
+
+    return ojson(users)
+
+# --------------------------------------------------
+# BOOTSTRAP: Site + Lists + Libraries + Users
+# --------------------------------------------------
+# Graph $batch can't feed one response's id into another request's URL, so
+# the site is resolved first and the collections go out in a single batch
+@app.route("/sharepoint/bootstrap", methods=["GET"])
+async def bootstrap():
+    headers = get_auth_headers()
+
+    # A cached site skips straight to the batch, which checks the caller's
+    # access to it
+    site_res, site = await resolve_site(headers)
+    if site is None:
+        return graph_error(site_res)
+
+    paths = {
+        "lists": LISTS_PATH.format(site_id=site["id"]),
+        "drives": DRIVES_PATH.format(site_id=site["id"])
+    }
+
+    # The People Picker directory rides along unless this caller has it already
+    users_key = cache_key(headers, USERS_URL)
+    directory = user_directories.get(users_key)
+    if directory is None:
+        paths["users"] = USERS_PATH
+
+    batch = {"requests": [{"id": name, "method": "GET", "url": url} for name, url in paths.items()]}
+    batch_res = await client.post(BATCH_URL, headers=headers, json=batch)
+    if not batch_res.is_success:
+        return graph_error(batch_res)
+
+    # Batch responses can come back in any order
+    responses = {r["id"]: r for r in orjson.loads(batch_res.content).get("responses", [])}
+    for r in responses.values():
+        if r["status"] >= 400:
+            return ojson({"error": "Graph API error", "details": r.get("body")}, r["status"])
+
+    pages = {name: responses[name]["body"] for name in paths}
+
+    # Remaining pages of each collection are independent; fetch them together
+    rest = await asyncio.gather(*(
+        graph_get_all(page.get("@odata.nextLink"), headers) for page in pages.values()
+    ))
+
+    values = {}
+    for (name, page), (res, more) in zip(pages.items(), rest):
+        if res is not None and not res.is_success:
+            return graph_error(res)
+        values[name] = page.get("value", []) + more
+
+    if directory is None:
+        directory = store_user_directory(users_key, values["users"])
+
+    return ojson({
+        **site_summary(site),
+        "lists": list_summaries(values["lists"]),
+        "libraries": document_libraries(values["drives"]),
+        "users": directory[1]
+    })
 
 # --------------------------------------------------
 # HEALTH
 # --------------------------------------------------
+# Probes hit this constantly; the body never changes
+HEALTH_BODY = orjson.dumps({"status": "Delegated SharePoint API running"})
+
 @app.route("/health", methods=["GET"])
-def health():
-    return jsonify({"status": "Delegated SharePoint API running"})
+async def health():
+    return Response(HEALTH_BODY, mimetype="application/json")
 
 # --------------------------------------------------
 # RUN
 # --------------------------------------------------
+# uvicorn picks uvloop and httptools when they're installed (not on
+# Windows) and falls back to asyncio otherwise. One worker per CPU unless
+# WEB_CONCURRENCY says otherwise. Each worker has its own Graph caches,
+# user directories, ETag validators and in-flight/save-coalescing maps, so
+# repeat reads only hit the cache when they land on the same process.
 if __name__ == "__main__":
+    import os
+    import uvicorn
+
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
     print("🚀 Backend running on http://localhost:5050")
-    app.run(host="127.0.0.1", port=5050, debug=False)
+    uvicorn.run("new:app", host="127.0.0.1", port=5050, loop="auto", http="auto", workers=workers)
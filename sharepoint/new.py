@@ -1,17 +1,218 @@
 
 
-import requests
-from flask import Flask, jsonify, request
-from flask_cors import CORS  # <--- NEW IMPORT
-
-app = Flask(__name__)
-CORS(app)  # <--- THIS ENABLES THE CONNECTION
+import asyncio
+import hashlib
+import re
+from functools import lru_cache
+from types import MappingProxyType
+from urllib.parse import quote
+
+import httpx
+import orjson
+from cachetools import TTLCache
+from quart import Quart, Response, request
+from quart_cors import cors
+
+app = Quart(__name__)
+app = cors(app)  # <--- THIS ENABLES THE CONNECTION
+# Flask had no upload size limit; keep it that way under Quart
+app.config["MAX_CONTENT_LENGTH"] = None
 
 GRAPH_BASE = "https://graph.microsoft.com/v1.0"
 
 HOSTNAME = "aoscaustralia.sharepoint.com"
 SITE_PATH = "/sites/CPA"
 
+# Graph URL templates, built once and filled with str.format per request
+SITE_URL = f"{GRAPH_BASE}/sites/{HOSTNAME}:{SITE_PATH}"
+LISTS_URL = GRAPH_BASE + "/sites/{site_id}/lists?$select=id,displayName,list"
+LIST_ITEMS_URL = GRAPH_BASE + "/sites/{site_id}/lists/{list_id}/items"
+LIST_ITEMS_PAGE_URL = LIST_ITEMS_URL + "?$select=id&$expand={expand}&$top=999"
+# {email} must already be escaped with odata_string()
+ITEM_SEARCH_URL = LIST_ITEMS_URL + "?expand=fields&$filter=fields/EmailAddress eq '{email}'"
+ITEM_FIELDS_URL = LIST_ITEMS_URL + "/{item_id}/fields"
+DRIVES_URL = GRAPH_BASE + "/sites/{site_id}/drives"
+DRIVE_CHILDREN_URL = GRAPH_BASE + "/drives/{drive_id}/root/children?$top=999"
+DRIVE_CONTENT_URL = GRAPH_BASE + "/drives/{drive_id}/root:/{filename}:/content"
+UPLOAD_SESSION_URL = GRAPH_BASE + "/drives/{drive_id}/root:/{filename}:/createUploadSession"
+USERS_URL = f"{GRAPH_BASE}/users?$select=displayName,mail,userPrincipalName&$top=999"
+BATCH_URL = f"{GRAPH_BASE}/$batch"
+
+GRAPH_MAX_RETRIES = 3
+# Graph rejects $batch envelopes with more than 20 requests
+GRAPH_BATCH_LIMIT = 20
+
+# Files up to 4 MiB go in one PUT; larger ones through an upload session in
+# 10 MiB chunks (Graph wants multiples of 320 KiB)
+SIMPLE_UPLOAD_LIMIT = 4 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 10 * 1024 * 1024
+
+CLAIMS_PREFIX = "i:0#.f|membership|"
+
+# Deliberately loose: one "@", no whitespace. Graph does the real matching
+EMAIL_PATTERN = re.compile(r"[^@\s]+@[^@\s]+")
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+# Successful Graph GETs by (token hash, url), one cache per resource with
+# its lifetime in seconds. Sites, lists, libraries and the user directory
+# change over minutes to hours but are read on every page render.
+GRAPH_CACHE_TTLS = {
+    "site": 60 * 60,
+    "lists": 10 * 60,
+    "libraries": 10 * 60,
+    "users": 60 * 60
+}
+graph_caches = {name: TTLCache(maxsize=1024, ttl=ttl) for name, ttl in GRAPH_CACHE_TTLS.items()}
+
+# Cached GETs currently in flight, by cache key
+graph_inflight = {}
+
+# --------------------------------------------------
+# Shared async HTTP client for all Graph calls
+# --------------------------------------------------
+# Keeps TLS connections to Graph alive between requests instead of
+# handshaking on every call; awaiting it leaves the event loop free to
+# serve other requests while Graph responds. HTTP/2 lets concurrent calls
+# share one connection. Tokens differ per user, so Authorization stays
+# per call rather than on the client.
+client = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(30.0, connect=3.0),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+)
+
+@app.after_serving
+async def close_client():
+    await client.aclose()
+
+# --------------------------------------------------
+# Helper: GET with retry on throttling / transient errors
+# --------------------------------------------------
+async def graph_get(url, headers):
+    for attempt in range(GRAPH_MAX_RETRIES + 1):
+        res = await client.get(url, headers=headers)
+        if res.status_code not in RETRYABLE_STATUS or attempt == GRAPH_MAX_RETRIES:
+            return res
+
+        retry_after = res.headers.get("Retry-After", "")
+        await asyncio.sleep(float(retry_after) if retry_after.isdigit() else 0.2 * 2 ** attempt)
+
+# --------------------------------------------------
+# Helper: JSON response via orjson
+# --------------------------------------------------
+def ojson(obj, status=200):
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+# --------------------------------------------------
+# Helper: JSON request body via orjson
+# --------------------------------------------------
+# None for a missing, non-JSON or malformed body, like a failed get_json()
+async def request_json():
+    if not request.is_json:
+        return None
+    try:
+        return orjson.loads(await request.get_data())
+    except orjson.JSONDecodeError:
+        return None
+
+# --------------------------------------------------
+# Helper: GET every page of a collection
+# --------------------------------------------------
+# Graph's skiptokens are opaque, so pages can't be requested ahead of time;
+# the next link has to come from the previous page
+async def graph_get_all(url, headers):
+    res, values = None, []
+    while url:
+        res = await graph_get(url, headers)
+        if not res.is_success:
+            break
+
+        page = orjson.loads(res.content)
+        values.extend(page.get("value", []))
+        url = page.get("@odata.nextLink")
+
+    return res, values
+
+# --------------------------------------------------
+# Helper: Stream every page of a collection as one JSON array
+# --------------------------------------------------
+# Pass-through routes only unwrap "value", so the array's bytes are sliced
+# out of Graph's envelope; an unexpected page shape is parsed instead.
+VALUE_ENVELOPE = re.compile(rb'\{"@odata\.context":"[^"]*"(?:,"@odata\.nextLink":("[^"]*"))?,"value":\[')
+
+def split_page(raw):
+    match = VALUE_ENVELOPE.match(raw)
+    if match and raw.endswith(b"]}"):
+        return raw[match.end():-2], orjson.loads(match.group(1)) if match.group(1) else None
+
+    page = orjson.loads(raw)
+    return orjson.dumps(page.get("value", []))[1:-1], page.get("@odata.nextLink")
+
+# Page one is awaited before responding so Graph errors keep their status;
+# the rest stream out one page at a time, and a failure mid-way aborts the
+# response rather than returning a short array.
+async def graph_stream_raw(url, headers):
+    res = await graph_get(url, headers)
+    if not res.is_success:
+        return res, None
+
+    async def body(res):
+        yield b"["
+        separator = b""
+        while True:
+            part, url = split_page(res.content)
+            if part:
+                yield separator + part
+                separator = b","
+            if not url:
+                break
+
+            res = await graph_get(url, headers)
+            res.raise_for_status()
+        yield b"]"
+
+    return res, body(res)
+
+# --------------------------------------------------
+# Helper: GET through the TTL cache
+# --------------------------------------------------
+# fetch is graph_get, or one returning (res, data) for collections
+async def cached_graph_get(url, headers, name, fetch=graph_get):
+    # Keyed by a 16-byte digest rather than the multi-KB token itself
+    token = hashlib.blake2b(headers["Authorization"].encode(), digest_size=16).digest()
+    cache = graph_caches[name]
+    key = (token, url)
+    if key in cache:
+        return cache[key]
+
+    # Concurrent misses for the same key share one Graph call
+    task = graph_inflight.get(key)
+    if task is None:
+        task = graph_inflight[key] = asyncio.ensure_future(fetch(url, headers))
+        task.add_done_callback(lambda _: graph_inflight.pop(key, None))
+
+    # Shielded so one caller disconnecting doesn't cancel the others' call
+    result = await asyncio.shield(task)
+    res = result[0] if isinstance(result, tuple) else result
+    if res.is_success:
+        cache[key] = result
+    return result
+
+# --------------------------------------------------
+# Helper: Quote a value for an OData string literal in a URL
+# --------------------------------------------------
+def odata_string(value):
+    # Quotes are doubled per OData; the rest is percent-encoded so "+", "#"
+    # and "&" reach Graph intact
+    return quote(value.replace("'", "''"), safe="@.")
+
+# --------------------------------------------------
+# Helper: Read an uploaded file in chunks for httpx
+# --------------------------------------------------
+async def read_chunks(stream, chunk_size=1024 * 1024):
+    while chunk := stream.read(chunk_size):
+        yield chunk
+
 # --------------------------------------------------
 # Helper: Get Delegated User Token
 # --------------------------------------------------
@@ -20,28 +221,32 @@ def get_headers():
     if not auth or not auth.startswith("Bearer "):
         return None
 
-    return {
+    return headers_for(auth)
+
+# Repeat callers get the same read-only mapping back; copy it to add headers
+@lru_cache(maxsize=256)
+def headers_for(auth):
+    return MappingProxyType({
         "Authorization": auth,
         "Content-Type": "application/json"
-    }
+    })
 
 # --------------------------------------------------
 # STEP 1: Resolve SharePoint Site
 # --------------------------------------------------
 @app.route("/sharepoint/site", methods=["GET"])
-def get_site():
+async def get_site():
     headers = get_headers()
     if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+        return ojson({"error": "Missing Authorization header"}, 401)
 
-    url = f"{GRAPH_BASE}/sites/{HOSTNAME}:{SITE_PATH}"
-    res = requests.get(url, headers=headers)
+    res = await cached_graph_get(SITE_URL, headers, "site")
 
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
+    if not res.is_success:
+        return ojson({"error": "Graph API error", "details": res.text}, res.status_code)
 
-    site = res.json()
-    return jsonify({
+    site = orjson.loads(res.content)
+    return ojson({
         "site_id": site["id"],
         "displayName": site["displayName"],
         "webUrl": site["webUrl"]
@@ -51,41 +256,44 @@ def get_site():
 # STEP 2: Get Lists
 # --------------------------------------------------
 @app.route("/sharepoint/<site_id>/lists", methods=["GET"])
-def get_lists(site_id):
+async def get_lists(site_id):
     headers = get_headers()
     if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+        return ojson({"error": "Missing Authorization header"}, 401)
 
-    url = f"{GRAPH_BASE}/sites/{site_id}/lists"
-    res = requests.get(url, headers=headers)
+    url = LISTS_URL.format(site_id=site_id)
+    res = await cached_graph_get(url, headers, "lists")
 
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
+    if not res.is_success:
+        return ojson({"error": "Graph API error", "details": res.text}, res.status_code)
 
     lists = [{
         "list_id": lst["id"],
         "displayName": lst.get("displayName"),
         "template": lst.get("list", {}).get("template")
-    } for lst in res.json().get("value", [])]
+    } for lst in orjson.loads(res.content).get("value", [])]
 
-    return jsonify(lists)
+    return ojson(lists)
 
 # --------------------------------------------------
 # STEP 3: Get List Items
 # --------------------------------------------------
 @app.route("/sharepoint/<site_id>/lists/<list_id>/items", methods=["GET"])
-def get_list_items(site_id, list_id):
+async def get_list_items(site_id, list_id):
     headers = get_headers()
     if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+        return ojson({"error": "Missing Authorization header"}, 401)
 
-    url = f"{GRAPH_BASE}/sites/{site_id}/lists/{list_id}/items?expand=fields"
-    res = requests.get(url, headers=headers)
+    # ?fields=Title,EmailAddress limits the columns returned; all by default
+    columns = request.args.get("fields")
+    expand = f"fields($select={quote(columns, safe=',')})" if columns else "fields"
+    url = LIST_ITEMS_PAGE_URL.format(site_id=site_id, list_id=list_id, expand=expand)
+    res, body = await graph_stream_raw(url, headers)
 
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
+    if not res.is_success:
+        return ojson({"error": "Graph API error", "details": res.text}, res.status_code)
 
-    return jsonify(res.json().get("value", []))
+    return Response(body, mimetype="application/json")
 
 
 
@@ -93,35 +301,36 @@ def get_list_items(site_id, list_id):
 # STEP 4: UPSERT ITEM (With "Prefer" Header Fix)
 # --------------------------------------------------
 @app.route("/sharepoint/<site_id>/lists/<list_id>/items", methods=["POST"])
-def upsert_list_item(site_id, list_id):
+async def upsert_list_item(site_id, list_id):
     headers = get_headers()
     if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+        return ojson({"error": "Missing Authorization header"}, 401)
 
-    body = request.get_json()
+    body = await request_json()
     if not body or "fields" not in body:
-        return jsonify({"error": "fields object required"}), 400
+        return ojson({"error": "fields object required"}, 400)
 
     fields = body["fields"]
     email = fields.get("EmailAddress")
     
     if not email:
-        return jsonify({"error": "EmailAddress is required to check for existing profile"}), 400
+        return ojson({"error": "EmailAddress is required to check for existing profile"}, 400)
+    if not isinstance(email, str) or not EMAIL_PATTERN.fullmatch(email):
+        return ojson({"error": "EmailAddress is not a valid email address"}, 400)
 
     # ✅ THE FIX: Add this special header to allow searching by Email
-    search_headers = headers.copy()
-    search_headers["Prefer"] = "HonorNonIndexedQueriesWarningMayFailRandomly"
+    search_headers = {**headers, "Prefer": "HonorNonIndexedQueriesWarningMayFailRandomly"}
 
     # Search for existing user by Email
-    search_url = f"{GRAPH_BASE}/sites/{site_id}/lists/{list_id}/items?expand=fields&$filter=fields/EmailAddress eq '{email}'"
+    search_url = ITEM_SEARCH_URL.format(site_id=site_id, list_id=list_id, email=odata_string(email))
     
     # Note: We use 'search_headers' here instead of just 'headers'
-    search_res = requests.get(search_url, headers=search_headers)
+    search_res = await graph_get(search_url, search_headers)
     
-    if not search_res.ok:
-        return jsonify({"error": "Failed to search list", "details": search_res.text}), 500
+    if not search_res.is_success:
+        return ojson({"error": "Failed to search list", "details": search_res.text}, 500)
 
-    search_data = search_res.json()
+    search_data = orjson.loads(search_res.content)
     existing_items = search_data.get("value", [])
 
     # Cleanup system fields
@@ -132,20 +341,20 @@ def upsert_list_item(site_id, list_id):
         # --- UPDATE (PATCH) ---
         item_id = existing_items[0]["id"]
         print(f"🔄 Found existing profile (ID: {item_id}). Updating...")
-        update_url = f"{GRAPH_BASE}/sites/{site_id}/lists/{list_id}/items/{item_id}/fields"
-        update_res = requests.patch(update_url, headers=headers, json=fields)
-        if not update_res.ok:
-            return jsonify({"error": "Failed to update item", "details": update_res.text}), 500
-        return jsonify({"status": "Updated", "id": item_id, "fields": fields}), 200
+        update_url = ITEM_FIELDS_URL.format(site_id=site_id, list_id=list_id, item_id=item_id)
+        update_res = await client.patch(update_url, headers=headers, json=fields)
+        if not update_res.is_success:
+            return ojson({"error": "Failed to update item", "details": update_res.text}, 500)
+        return ojson({"status": "Updated", "id": item_id, "fields": fields}, 200)
 
     else:
         # --- CREATE (POST) ---
         print("🆕 No profile found. Creating new...")
-        create_url = f"{GRAPH_BASE}/sites/{site_id}/lists/{list_id}/items"
-        create_res = requests.post(create_url, headers=headers, json={"fields": fields})
-        if not create_res.ok:
-            return jsonify({"error": "Failed to create item", "details": create_res.text}), 500
-        return jsonify(create_res.json()), 201
+        create_url = LIST_ITEMS_URL.format(site_id=site_id, list_id=list_id)
+        create_res = await client.post(create_url, headers=headers, json={"fields": fields})
+        if not create_res.is_success:
+            return ojson({"error": "Failed to create item", "details": create_res.text}, 500)
+        return Response(create_res.content, status=201, mimetype="application/json")
     
 
 
@@ -155,108 +364,177 @@ def upsert_list_item(site_id, list_id):
 # STEP 5: Get Document Libraries
 # --------------------------------------------------
 @app.route("/sharepoint/<site_id>/libraries", methods=["GET"])
-def get_libraries(site_id):
+async def get_libraries(site_id):
     headers = get_headers()
     if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+        return ojson({"error": "Missing Authorization header"}, 401)
 
-    url = f"{GRAPH_BASE}/sites/{site_id}/drives"
-    res = requests.get(url, headers=headers)
+    url = DRIVES_URL.format(site_id=site_id)
+    res = await cached_graph_get(url, headers, "libraries")
 
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
+    if not res.is_success:
+        return ojson({"error": "Graph API error", "details": res.text}, res.status_code)
 
     libraries = [
-        d for d in res.json().get("value", [])
+        d for d in orjson.loads(res.content).get("value", [])
         if d.get("driveType") == "documentLibrary"
     ]
 
-    return jsonify(libraries)
+    return ojson(libraries)
 
 # --------------------------------------------------
 # STEP 6: Get Documents
 # --------------------------------------------------
 @app.route("/sharepoint/<site_id>/libraries/<drive_id>/documents", methods=["GET"])
-def get_documents(site_id, drive_id):
+async def get_documents(site_id, drive_id):
     headers = get_headers()
     if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+        return ojson({"error": "Missing Authorization header"}, 401)
 
-    url = f"{GRAPH_BASE}/drives/{drive_id}/root/children"
-    res = requests.get(url, headers=headers)
+    url = DRIVE_CHILDREN_URL.format(drive_id=drive_id)
+    res, body = await graph_stream_raw(url, headers)
 
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
+    if not res.is_success:
+        return ojson({"error": "Graph API error", "details": res.text}, res.status_code)
 
-    return jsonify(res.json().get("value", []))
+    return Response(body, mimetype="application/json")
 
 # --------------------------------------------------
 # STEP 7: Upload Document
 # --------------------------------------------------
 @app.route("/sharepoint/<site_id>/libraries/<drive_id>/upload", methods=["POST"])
-def upload_document(site_id, drive_id):
+async def upload_document(site_id, drive_id):
     headers = get_headers()
     if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
+        return ojson({"error": "Missing Authorization header"}, 401)
 
-    if "file" not in request.files:
-        return jsonify({"error": "No file provided"}), 400
+    files = await request.files
+    if "file" not in files:
+        return ojson({"error": "No file provided"}, 400)
 
-    file = request.files["file"]
+    file = files["file"]
 
-    upload_url = f"{GRAPH_BASE}/drives/{drive_id}/root:/{file.filename}:/content"
+    # The spooled upload is sent in chunks rather than read into memory whole
+    stream = file.stream
+    size = stream.seek(0, 2)
+    stream.seek(0)
 
-    upload_headers = {
-        "Authorization": headers["Authorization"],
-        "Content-Type": file.content_type or "application/octet-stream"
-    }
+    if size <= SIMPLE_UPLOAD_LIMIT:
+        upload_url = DRIVE_CONTENT_URL.format(drive_id=drive_id, filename=file.filename)
 
-    res = requests.put(upload_url, headers=upload_headers, data=file.read())
+        upload_headers = {
+            "Authorization": headers["Authorization"],
+            "Content-Type": file.content_type or "application/octet-stream",
+            "Content-Length": str(size)
+        }
 
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
+        res = await client.put(upload_url, headers=upload_headers, content=read_chunks(stream))
+    else:
+        session_url = UPLOAD_SESSION_URL.format(drive_id=drive_id, filename=file.filename)
+        res = await client.post(session_url, headers=headers, json={})
+
+        if res.is_success:
+            # The upload URL is pre-authenticated; sending the bearer token
+            # to it makes Graph reject the request
+            upload_url = orjson.loads(res.content)["uploadUrl"]
+            offset = 0
+            while chunk := stream.read(UPLOAD_CHUNK_SIZE):
+                end = offset + len(chunk) - 1
+                res = await client.put(
+                    upload_url,
+                    headers={"Content-Range": f"bytes {offset}-{end}/{size}"},
+                    content=chunk
+                )
+                if not res.is_success:
+                    break
+                offset = end + 1
+
+    if not res.is_success:
+        return ojson({"error": "Graph API error", "details": res.text}, res.status_code)
+
+    return Response(res.content, mimetype="application/json")
 
-    return jsonify(res.json())
+# --------------------------------------------------
+# Helper: Fetch the directory as People Picker entries
+# --------------------------------------------------
+async def graph_get_user_entries(url, headers):
+    res, values = await graph_get_all(url, headers)
+    return res, [{
+        "displayName": u["displayName"],
+        "email": email,
+        "claims": CLAIMS_PREFIX + email
+    } for u in values if (email := u.get("mail") or u.get("userPrincipalName"))]
 
 # --------------------------------------------------
 # STEP 8: Get Users (People Picker)
 # --------------------------------------------------
 @app.route("/graph/users", methods=["GET"])
-def graph_get_users():
+async def graph_get_users():
     headers = get_headers()
     if not headers:
-        return jsonify({"error": "Missing Authorization header"}), 401
-
-    url = f"{GRAPH_BASE}/users?$select=displayName,mail,userPrincipalName"
-    res = requests.get(url, headers=headers)
+        return ojson({"error": "Missing Authorization header"}, 401)
 
-    if not res.ok:
-        return jsonify({"error": "Graph API error", "details": res.text}), res.status_code
+    # The picker entries are cached already built, not rebuilt per request
+    res, users = await cached_graph_get(USERS_URL, headers, "users", graph_get_user_entries)
 
-    users = []
-    for u in res.json().get("value", []):
-        email = u.get("mail") or u.get("userPrincipalName")
-        if not email:
-            continue
+    if not res.is_success:
+        return ojson({"error": "Graph API error", "details": res.text}, res.status_code)
 
-        users.append({
-            "displayName": u["displayName"],
-            "email": email,
-            "claims": f"i:0#.f|membership|{email}"
-        })
+    return ojson(users)
 
-    return jsonify(users)
+# --------------------------------------------------
+# STEP 9: Batch Graph Reads ($batch)
+# --------------------------------------------------
+# Lets the dashboard fetch e.g. site + lists + libraries in one round trip.
+# Only GETs against Graph-relative urls are forwarded, with the caller's token.
+@app.route("/sharepoint/batch", methods=["POST"])
+async def batch_graph_get():
+    headers = get_headers()
+    if not headers:
+        return ojson({"error": "Missing Authorization header"}, 401)
+
+    body = await request_json()
+    if (not isinstance(body, list) or not 0 < len(body) <= GRAPH_BATCH_LIMIT
+            or not all(isinstance(r, dict) and str(r.get("url", "")).startswith("/") for r in body)):
+        return ojson({"error": f"Array of 1-{GRAPH_BATCH_LIMIT} requests with relative Graph urls required"}, 400)
+
+    # Graph rejects duplicate ids, so sub-requests are numbered here and the
+    # caller's own ids (index by default) are only used in the reply
+    batch = {"requests": [
+        {"id": str(i), "method": "GET", "url": r["url"]}
+        for i, r in enumerate(body)
+    ]}
+    res = await client.post(BATCH_URL, headers=headers, json=batch)
+
+    if not res.is_success:
+        return ojson({"error": "Graph API error", "details": res.text}, res.status_code)
+
+    # Graph may answer sub-requests in any order; return them in request order
+    responses = {r["id"]: r for r in orjson.loads(res.content).get("responses", [])}
+    return ojson([{
+        "id": str(r.get("id", i)),
+        "status": responses.get(str(i), {}).get("status"),
+        "body": responses.get(str(i), {}).get("body")
+    } for i, r in enumerate(body)])
 
 # --------------------------------------------------
 # HEALTH
 # --------------------------------------------------
 @app.route("/health", methods=["GET"])
-def health():
-    return jsonify({"status": "Delegated SharePoint API running"})
+async def health():
+    return ojson({"status": "Delegated SharePoint API running"})
 
 # --------------------------------------------------
 # RUN
 # --------------------------------------------------
+# uvloop and httptools are used when installed (not on Windows). Defaults
+# to a worker per CPU; WEB_CONCURRENCY overrides it. graph_caches and
+# graph_inflight live in each worker, so a cached read or a shared
+# in-flight call only helps requests served by the same process.
 if __name__ == "__main__":
+    import os
+    import uvicorn
+
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
     print("🚀 Backend running on http://localhost:5050")
-    app.run(host="127.0.0.1", port=5050, debug=False)
+    uvicorn.run("new:app", host="127.0.0.1", port=5050, loop="auto", http="auto", workers=workers)
@@ -1,9 +1,15 @@
 import os
-import json
-import requests
+import re
+import orjson
+import asyncio
+import hashlib
 import traceback
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+import httpx
+from cachetools import TTLCache
 from fastapi import FastAPI, HTTPException, Request, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 
 # ================= ENV =================
@@ -15,7 +21,36 @@ if not OPENROUTER_API_KEY:
 
 GRAPH_BASE = "https://graph.microsoft.com/v1.0"
 
-app = FastAPI(title="AI Onboarding Agent - KYC Validator")
+# Concurrent OpenRouter calls; more just queue up behind the rate limit
+AI_MAX_CONCURRENCY = 8
+_ai_limit = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+# Parsed AI verdicts for recently validated records, keyed by BLAKE2b of
+# the record text. Entries expire after a day so a prompt or model change
+# is picked up without a restart.
+AI_CACHE_SIZE = 10_000
+AI_CACHE_TTL = 24 * 60 * 60
+_ai_cache = TTLCache(maxsize=AI_CACHE_SIZE, ttl=AI_CACHE_TTL)
+
+# ================= HTTP CLIENT =================
+
+# Shared pooled client for Graph and OpenRouter calls. Graph tokens differ
+# per user, so auth headers are passed on each call rather than set here.
+_client = httpx.AsyncClient(
+    http2=True,
+    timeout=60,
+    limits=httpx.Limits(max_connections=32, keepalive_expiry=120)
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await _client.aclose()
+
+app = FastAPI(
+    title="AI Onboarding Agent - KYC Validator",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
+)
 
 # ================= AUTH =================
 def get_headers(request: Request):
@@ -29,26 +64,29 @@ def get_headers(request: Request):
     }
 
 # ================= HELPER: FIELDS → TEXT =================
+# SharePoint encodes spaces and slashes in internal column names
+ENCODED_CHARS = re.compile(r"_x00(20|2f)_")
+DECODED_CHARS = {"20": " ", "2f": "/"}
+
+def _decode_char(match):
+    return DECODED_CHARS[match.group(1)]
+
 def fields_to_text(fields: dict) -> str:
-    lines = []
-    for key, value in fields.items():
-        clean_key = key.replace("_x0020_", " ").replace("_x002f_", "/")
-        if value and str(value).strip():
-            lines.append(f"{clean_key}: {value}")
-        else:
-            lines.append(f"{clean_key}: Missing")
-    return "\n".join(lines)
+    return "\n".join(
+        f"{ENCODED_CHARS.sub(_decode_char, key)}: {value if value and str(value).strip() else 'Missing'}"
+        for key, value in fields.items()
+    )
 
 # ================= AI ANALYSIS =================
-def analyze_onboarding_with_ai(context: str):
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:8000",
-        "X-Title": "ai-onboarding-agent"
-    }
+OPENROUTER_HEADERS = {
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+    "Content-Type": "application/json",
+    "HTTP-Referer": "http://localhost:8000",
+    "X-Title": "ai-onboarding-agent"
+}
 
-    prompt = f"""
+# Only the record text changes between calls; filled in with %
+PROMPT_TEMPLATE = """
 You are an intelligent client onboarding and KYC validation assistant.
 
 Analyze the onboarding information below and do the following:
@@ -62,22 +100,31 @@ Analyze the onboarding information below and do the following:
 ONLY report issues. Do NOT repeat fields that are already valid.
 
 Onboarding Data:
-{context}
+%s
 
 Return STRICT JSON in this format:
 
-{{
+{
   "document_type": "Client Onboarding / KYC",
   "status": "CLEAR or NEEDS_ATTENTION",
-  "issues": {{
+  "issues": {
     "missing_fields": ["field name"],
     "invalid_fields": ["field name or issue"],
     "risks": ["risk description"]
-  }},
+  },
   "message": "short plain-English explanation"
-}}
+}
 """
 
+async def analyze_onboarding_with_ai(context: str):
+    # An unchanged record gets the same verdict without another paid call
+    key = hashlib.blake2b(context.encode("utf-8"), digest_size=16).digest()
+    verdict = _ai_cache.get(key)
+    if verdict is not None:
+        return verdict
+
+    prompt = PROMPT_TEMPLATE % context
+
     payload = {
         "model": "openai/gpt-4o-mini",
         "messages": [
@@ -87,47 +134,83 @@ Return STRICT JSON in this format:
         "max_tokens": 300
     }
 
-    res = requests.post(
-        "https://openrouter.ai/api/v1/chat/completions",
-        headers=headers,
-        json=payload,
-        timeout=60
-    )
+    async with _ai_limit:
+        res = await _client.post(
+            "https://openrouter.ai/api/v1/chat/completions",
+            headers=OPENROUTER_HEADERS,
+            json=payload
+        )
 
     if res.status_code != 200:
-        return {
-            "error": "AI analysis failed",
-            "status_code": res.status_code,
-            "response": res.text
-        }
+        return AI_PARSE_FALLBACK
 
-    return res.json()["choices"][0]["message"]["content"]
+    content = orjson.loads(res.content)["choices"][0]["message"]["content"]
+    verdict = parse_ai_json(content)
+    # Only usable verdicts are kept; a malformed reply is retried next time
+    if verdict is not AI_PARSE_FALLBACK:
+        _ai_cache[key] = verdict
+    return verdict
 
 # ================= AI JSON PARSER =================
+# Returned as-is whenever the AI reply can't be used; callers only read it
+AI_PARSE_FALLBACK = {
+    "document_type": "Client Onboarding / KYC",
+    "status": "NEEDS_ATTENTION",
+    "issues": {
+        "missing_fields": [],
+        "invalid_fields": [],
+        "risks": ["AI response could not be parsed"]
+    },
+    "message": "Unable to reliably analyze onboarding data."
+}
+
 def parse_ai_json(ai_text: str):
+    # The reply's content can be null
+    if not isinstance(ai_text, str):
+        return AI_PARSE_FALLBACK
+
+    # Remove ```json ``` or ``` wrappers
+    cleaned = ai_text.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned[3:]
+        if cleaned.startswith("json"):
+            cleaned = cleaned[4:]
+        cleaned = cleaned.rsplit("```", 1)[0]
+
     try:
-        cleaned = ai_text.replace("```json", "").replace("```", "").strip()
-        return json.loads(cleaned)
-    except Exception:
-        return {
-            "document_type": "Client Onboarding / KYC",
-            "status": "NEEDS_ATTENTION",
-            "issues": {
-                "missing_fields": [],
-                "invalid_fields": [],
-                "risks": ["AI response could not be parsed"]
-            },
-            "message": "Unable to reliably analyze onboarding data."
-        }
+        return orjson.loads(cleaned)
+    except orjson.JSONDecodeError:
+        pass
+
+    # Prose before or after a fence: fall back to the outermost braces
+    start, end = cleaned.find("{"), cleaned.rfind("}")
+    if start != -1 and end > start:
+        try:
+            return orjson.loads(cleaned[start:end + 1])
+        except orjson.JSONDecodeError:
+            pass
+
+    return AI_PARSE_FALLBACK
 
 # ================= MAIN API =================
+# SharePoint system columns the AI may report as missing; never shown to users
+SYSTEM_FIELDS = frozenset({
+    "Attachments",
+    "Edit",
+    "_ComplianceFlags",
+    "_ComplianceTag",
+    "_ComplianceTagWrittenTime",
+    "_ComplianceTagUserId"
+})
+
 @app.get("/onboarding/{hostname}/sites/{site_name}/lists/{list_id}")
 async def process_onboarding(
     request: Request,
     hostname: str,
     site_name: str,
     list_id: str,
-    query: str = Query(..., description="Value to identify onboarding record")
+    query: str = Query(..., description="Value to identify onboarding record"),
+    field: str = Query(None, description="Column to match the value against (searches all columns if omitted)")
 ):
     headers = get_headers(request)
     if not headers:
@@ -136,29 +219,37 @@ async def process_onboarding(
     try:
         # 1. Resolve Site ID
         site_url = f"{GRAPH_BASE}/sites/{hostname}:/sites/{site_name}"
-        site_res = requests.get(site_url, headers=headers)
-        if not site_res.ok:
-            return JSONResponse(status_code=site_res.status_code, content={"error": "Invalid site path"})
+        site_res = await _client.get(site_url, headers=headers)
+        if not site_res.is_success:
+            return ORJSONResponse(status_code=site_res.status_code, content={"error": "Invalid site path"})
 
-        site_id = site_res.json().get("id")
+        site_id = orjson.loads(site_res.content).get("id")
 
         # 2. Fetch list items
         list_url = f"{GRAPH_BASE}/sites/{site_id}/lists/{list_id}/items?expand=fields"
-        items_res = requests.get(list_url, headers=headers)
-        items = items_res.json().get("value", [])
+        list_headers = headers
+        if field:
+            # A known column lets Graph do the lookup instead of sending the whole list
+            value = quote(query.strip().replace("'", "''"), safe="@.")
+            list_url += f"&$filter=fields/{quote(field, safe='')} eq '{value}'"
+            list_headers = {**headers, "Prefer": "HonorNonIndexedQueriesWarningMayFailRandomly"}
+        items_res = await _client.get(list_url, headers=list_headers)
+        # A column Graph can't filter on comes back as a 400, not an empty list
+        if not items_res.is_success:
+            return ORJSONResponse(
+                status_code=items_res.status_code,
+                content={"error": "Graph API error", "details": items_res.text}
+            )
+        items = orjson.loads(items_res.content).get("value", [])
 
-        target_item = None
         clean_query = query.strip().lower()
 
-        # 3. Find matching record
-        for item in items:
-            fields = item.get("fields", {})
-            for _, val in fields.items():
-                if val and str(val).strip().lower() == clean_query:
-                    target_item = item
-                    break
-            if target_item:
-                break
+        # 3. Find matching record (first item with any field equal to the query)
+        target_item = next((
+            item for item in items
+            if any(val and str(val).strip().lower() == clean_query
+                   for val in item.get("fields", {}).values())
+        ), None)
 
         if not target_item:
             raise HTTPException(status_code=404, detail=f"No onboarding record found for '{query}'")
@@ -175,19 +266,9 @@ async def process_onboarding(
         # return ai_result
 
 
-        ai_raw = analyze_onboarding_with_ai(context)
-        ai_result = parse_ai_json(ai_raw)
+        ai_result = await analyze_onboarding_with_ai(context)
         issues = ai_result.get("issues", {})
         # Filter out SharePoint system fields
-         
-        SYSTEM_FIELDS = [
-        "Attachments",
-        "Edit",
-        "_ComplianceFlags",
-        "_ComplianceTag",
-        "_ComplianceTagWrittenTime",
-        "_ComplianceTagUserId"
-        ]
         missing = [
             f for f in issues.get("missing_fields", [])
             if f not in SYSTEM_FIELDS
@@ -232,9 +313,14 @@ async def process_onboarding(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# A worker per CPU unless WEB_CONCURRENCY is set; uvicorn needs the import
+# string to start them. uvloop and httptools are picked up when installed.
+# The AI verdict cache and the OpenRouter semaphore are per worker, so the
+# effective concurrency cap is AI_MAX_CONCURRENCY times the worker count.
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    uvicorn.run("main:app", host="127.0.0.1", port=8000, loop="auto", http="auto", workers=workers)
 
 
 